@@ -1,15 +1,30 @@
+import math
+import uuid
 import streamlit as st
-import pandas as pd
 from src.answer import answer
+from src.chats import (
+    PAGE_SIZE,
+    add_message,
+    count_messages,
+    create_chat,
+    csv_header,
+    export_chats,
+    get_page,
+    get_recent,
+    list_chats,
+)
 import plotly.express as px
 import json
 
-def get_context():
-    recent_messages = current_chat.tail(3)
-    context = ""
-    for index, row in recent_messages.iterrows():
-        context += f"Query: {row['query']} \nResponse: {row['response']}\n==========================\n"
-    return context
+def get_context(query):
+    # Only follow-ups use history; formatting and trimming happens in src.budget
+    if not query.lower().startswith("follow up:"):
+        return []
+    return get_recent(current_chat_id, 3)
+
+def save_message(query, response):
+    add_message(current_chat_id, query, response)
+    st.session_state["message_counts"][current_chat_id] += 1
 
 # == PAGE CONFIGURATION ==
 st.set_page_config(
@@ -19,17 +34,22 @@ with open("style.css") as css:
     st.markdown(f"<style>{css.read()}</style>", unsafe_allow_html=True)
 
 # Initialize session state if not already present
-if "chats" not in st.session_state:
-    st.session_state["chats"] = {"0": pd.DataFrame({"query": [], "response": []})}
-if "chat_counter" not in st.session_state:
-    st.session_state["chat_counter"] = 1
-if "current_chat_id" not in st.session_state:
-    st.session_state["current_chat_id"] = "0"
-if "past_queries" not in st.session_state:
-    st.session_state["past_queries"] = []
+if "session_key" not in st.session_state:
+    st.session_state["session_key"] = str(uuid.uuid4())
+    chats = list_chats()
+    # Each browser session writes to its own chat; the id is kept in the URL so a reload resumes it
+    chat_param = st.query_params.get("chat", "")
+    if chat_param.isdigit() and int(chat_param) in chats:
+        chat_id = int(chat_param)
+    else:
+        chat_id = create_chat()
+        chats.append(chat_id)
+    st.session_state["chats"] = chats
+    st.session_state["current_chat_id"] = chat_id
+    st.session_state["message_counts"] = count_messages([chat_id])
 
 current_chat_id = st.session_state["current_chat_id"]
-current_chat = st.session_state["chats"][current_chat_id]
+st.query_params["chat"] = str(current_chat_id)
 
 # Streamlit UI
 st.title("Financial Document Question Answering System")
@@ -53,7 +73,7 @@ if query:
     if query.strip() == "":
         st.warning("Please enter a query.")
     else:
-        response, classification = answer(query, current_chat_id, get_context())
+        response, classification = answer(query, f"{st.session_state['session_key']}:{current_chat_id}", get_context(query))
 
         if response:
             if isinstance(response, str):
@@ -61,9 +81,7 @@ if query:
                     # Display error in an error box
                     st.error(response, icon="🚨")
                 else:
-                    current_chat.loc[len(current_chat)] = [query, response] #slices data set length into query and response
-                    st.session_state["chats"][current_chat_id] = current_chat #sets this current chat
-                    st.session_state["past_queries"].append((query, response))
+                    save_message(query, response)
                     with st.chat_message(
                         "program"
                     ):
@@ -112,9 +130,7 @@ if query:
                         )
                         st.plotly_chart(fig, use_container_width=True)
                         response = json.dumps(response)
-                        current_chat.loc[len(current_chat)] = [query, response] #slices data set length into query and response
-                        st.session_state["chats"][current_chat_id] = current_chat #sets this current chat
-                        st.session_state["past_queries"].append((query, response))
+                        save_message(query, response)
                     except json.JSONDecodeError:
                         st.error("Failed to parse visualization data")
         else:
@@ -122,9 +138,48 @@ if query:
 else:
     st.error("Please enter a query.")
 
+# Messages are append-only, so a page is identified by the message count it
+# was read at and only refetched after that changes
+@st.cache_data(max_entries=64)
+def load_page(chat_id, page, message_count):
+    return get_page(chat_id, page, message_count)
+
+@st.cache_resource
+def export_pieces():
+    # chat_id -> (message count, CSV rows), shared across sessions without copying
+    return {}
+
+def build_exports():
+    chat_ids = list_chats()
+    st.session_state["chats"] = chat_ids
+    # Versions come from the database, so only chats with new messages are re-read
+    counts = count_messages(chat_ids)
+    pieces = export_pieces()
+    stale = {
+        chat_id: count
+        for chat_id, count in counts.items()
+        if pieces.get(chat_id, (None,))[0] != count
+    }
+    for chat_id, rows in export_chats(stale).items():
+        pieces[chat_id] = (stale[chat_id], rows)
+    header = csv_header()
+    st.session_state["exports"] = {
+        "chat_id": current_chat_id,
+        "current": header + pieces[current_chat_id][1],
+        "all": header + b"".join(pieces[chat_id][1] for chat_id in chat_ids),
+    }
+
 st.subheader("Past Queries and Responses:")
-if st.session_state["past_queries"]:
-    for idx, (q, r) in enumerate(st.session_state["past_queries"]):
+message_count = st.session_state["message_counts"][current_chat_id]
+if message_count:
+    page_count = math.ceil(message_count / PAGE_SIZE)
+    page = 0
+    if page_count > 1:
+        # Defaults to the newest page; only the selected page is fetched
+        page = st.number_input(
+            f"Page (1-{page_count})", min_value=1, max_value=page_count, value=page_count
+        ) - 1
+    for idx, (q, r) in enumerate(load_page(current_chat_id, page, message_count), start=page * PAGE_SIZE):
         st.markdown(f"**Query {idx + 1}:** {q}")
         st.markdown(f"**Answer:** {r}")
         st.markdown("---")
@@ -134,51 +189,34 @@ else:
 # Load previous chat stats
 def load_chat(chat_id):
     st.session_state["current_chat_id"] = chat_id
-    st.session_state["past_queries"] = [
-        (query, response)
-        for query, response in zip(
-            st.session_state["chats"][chat_id]["query"],
-            st.session_state["chats"][chat_id]["response"],
-        )
-    ]
+    st.session_state["message_counts"].update(count_messages([chat_id]))
 
 def start_new_chat():
-    new_chat_id = str(st.session_state["chat_counter"])
-    st.session_state["chats"][new_chat_id] = pd.DataFrame({"query": [], "response": []})
-    st.session_state["chat_counter"] += 1
+    new_chat_id = create_chat()
+    st.session_state["chats"].append(new_chat_id)
+    st.session_state["message_counts"][new_chat_id] = 0
     st.session_state["current_chat_id"] = new_chat_id
-    st.session_state["past_queries"] = []
-
-def convert_df(df):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.to_csv().encode("utf-8")
-
-def flatten_chats(chats):
-    flattened = pd.DataFrame({"query": [], "response": []})
-    for chat in chats.values():
-        flattened = pd.concat([flattened, chat], ignore_index=True)
-    return flattened.to_csv().encode("utf-8")
-
-chat_csv = convert_df(current_chat)
-all_chat_csv = flatten_chats(st.session_state["chats"])
 
 # Sidebar for chat management
 with st.sidebar:
-    st.subheader("Download current chat history")
-    st.download_button(
-        label="Download current chat history as CSV",
-        data=chat_csv,
-        file_name=f"{current_chat_id}_chat_history.csv",
-        mime="text/csv"
-    )
-
-    st.subheader("Download all chat history")
-    st.download_button(
-        label="Download all chat history as CSV",
-        data=all_chat_csv,
-        file_name="chat_history.csv",
-        mime="text/csv"
-    )
+    st.subheader("Download chat history")
+    # Exports are only built on request instead of on every rerun
+    if st.button("Build chat history export"):
+        build_exports()
+    exports = st.session_state.get("exports")
+    if exports:
+        st.download_button(
+            label="Download current chat history as CSV",
+            data=exports["current"],
+            file_name=f"{exports['chat_id']}_chat_history.csv",
+            mime="text/csv"
+        )
+        st.download_button(
+            label="Download all chat history as CSV",
+            data=exports["all"],
+            file_name="chat_history.csv",
+            mime="text/csv"
+        )
 
     st.subheader("Create Chat")
     if st.button("New Chat"):
@@ -186,7 +224,7 @@ with st.sidebar:
         st.rerun()  # Refreshes page
 
     st.subheader("Load Previous Chats")
-    for chat in st.session_state["chats"].keys():
+    for chat in st.session_state["chats"]:
         if st.button(f"Load Chat {chat}"):
             load_chat(chat)
             st.rerun() #refreshes page
@@ -11,21 +11,24 @@ from src.documents import get_documents, get_params
 
 sys.path.append(os.path.dirname(__file__))
 
-async def log_kpi(tokens, time, query, response, followup):
+async def log_kpi(tokens, time, query, response, followup, decision=None):
     db = Prisma()
     await db.connect()
-    await db.log.create(
-        {
-            "tokensUsed": tokens,
-            "timeSpent": time,
-            "query": query,
-            "response": response,
-            "followup": followup,
-        }
-    )
+    data = {
+        "tokensUsed": tokens,
+        "timeSpent": time,
+        "query": query,
+        "response": response,
+        "followup": followup,
+    }
+    if decision:
+        data["model"] = decision["model"]
+        data["contextTokens"] = decision["context_tokens"]
+        data["tokensSaved"] = decision["tokens_saved"]
+    await db.log.create(data)
     await db.disconnect()
 
-def answer(query, index, context):
+def answer(query, index, history):
     start = time.time()
     
     if not query.lower().startswith("follow up:"):
@@ -36,6 +39,9 @@ def answer(query, index, context):
                 params, param_tokens = get_params(query)
                 print(params)
 
+            if "Error" in params:
+                return f"Error processing query: {params['Error']}", "text"
+
             # Extract classification from params
             classification = params.get("category", "text").lower()  # Default to "text" if not specified
 
@@ -45,16 +51,16 @@ def answer(query, index, context):
 
             if folder_name:
                 # Get response using folder name, user query, and classification
-                response, response_tokens = get_response(folder_name, query, classification, index)
+                response, response_tokens, decision = get_response(folder_name, query, classification, index)
 
                 tokens = param_tokens + response_tokens
                 end = time.time()
                 length = end - start
 
                 if classification == "visualization":
-                    asyncio.run(log_kpi(tokens, length, query, json.dumps(response), False))
+                    asyncio.run(log_kpi(tokens, length, query, json.dumps(response), False, decision))
                 else:
-                    asyncio.run(log_kpi(tokens, length, query, response, False))
+                    asyncio.run(log_kpi(tokens, length, query, response, False, decision))
 
                 return response, classification
             else:
@@ -64,20 +70,20 @@ def answer(query, index, context):
             return f"Error processing query: {e}", "text"
         
         finally:
-            if folder_name != "" and os.path.exists(folder_name):
+            if folder_name and os.path.exists(folder_name):
                 shutil.rmtree(folder_name)
                 print(f"Deleted folder: {folder_name}")
     else:
         # Handle follow-up queries
         with st.spinner("Generating response..."):
-            response, response_tokens, classification = get_follow_up(query, index, context)
+            response, response_tokens, classification, decision = get_follow_up(query, index, history)
 
         end = time.time()
         length = end - start
 
         if classification == "visualization":
-            asyncio.run(log_kpi(response_tokens, length, query, json.dumps(response), False))
+            asyncio.run(log_kpi(response_tokens, length, query, json.dumps(response), False, decision))
         else:
-            asyncio.run(log_kpi(response_tokens, length, query, response, False))
+            asyncio.run(log_kpi(response_tokens, length, query, response, False, decision))
 
         return response, classification
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.documents import get_documents, get_params  # noqa: E402
+from src.query import build_index, query_index  # noqa: E402
+
+PARSE_WORKERS = 8
+FETCH_WORKERS = 2  # SEC requests are also rate limited across workers in src.edgar_cache
+ANSWER_WORKERS = 4
+
+
+def read_questions(path):
+    """
+    Reads a JSONL file of questions. Each line is either a JSON string or an
+    object with a "question" (or "query") field and an optional "id".
+    """
+    questions = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            question = item.get("question") or item.get("query")
+            if not question:
+                raise ValueError(f"Line {line_number} has no question")
+            questions.append({"id": item.get("id", line_number), "question": question})
+    return questions
+
+
+def parse_question(question):
+    start = time.time()
+    try:
+        params, tokens = get_params(question)
+    except Exception as e:
+        params, tokens = {"Error": str(e)}, 0
+    return params, tokens, time.time() - start
+
+
+def filing_units(params):
+    """
+    Splits a question into (cik, quarter) units. Each unit is fetched and
+    indexed once per batch, and a question is answered over the union of its
+    units' indexes, so "Apple Q1" and "Apple vs Microsoft Q1" share Apple's
+    filings.
+    """
+    return sorted(
+        {(cik.zfill(10), timeframe) for cik in params["ciks"] for timeframe in params["timeframes"]}
+    )
+
+
+def fetch_and_index(unit, relevant_forms):
+    cik, timeframe = unit
+    start = time.time()
+    try:
+        folder_name = get_documents(
+            {
+                "ciks": [cik],
+                "timeframes": [timeframe],
+                "relevant_forms": sorted(relevant_forms),
+            }
+        )
+    except Exception as e:
+        print(f"Failed to fetch {cik} {timeframe}: {e}")
+        folder_name = None
+    fetched = time.time()
+    if not folder_name:
+        return None, None, fetched - start, 0.0
+    try:
+        index = build_index(folder_name)
+    except Exception as e:
+        print(f"Failed to index {cik} {timeframe}: {e}")
+        index = None
+    return folder_name, index, fetched - start, time.time() - fetched
+
+
+def answer_question(index, question, classification):
+    start = time.time()
+    try:
+        response, decision = query_index(index, question, classification)
+        error = None
+    except Exception as e:
+        response, decision, error = None, None, f"Error processing query: {e}"
+    return response, decision, error, time.time() - start
+
+
+def run_batch(
+    questions,
+    parse_workers=PARSE_WORKERS,
+    fetch_workers=FETCH_WORKERS,
+    answer_workers=ANSWER_WORKERS,
+    on_result=None,
+):
+    """
+    Answers a list of {"id", "question"} dicts.
+
+    Questions are parsed concurrently, each (cik, quarter) unit is fetched
+    and indexed once for the whole batch, and answers are generated with
+    bounded parallelism. Each result is passed to on_result as soon as it is
+    final; if the batch stops early, the unfinished ones are passed with an
+    error. Returns one result dict per question, in input order.
+    """
+    results = [
+        {
+            "id": item["id"],
+            "question": item["question"],
+            "category": None,
+            "response": None,
+            "error": None,
+            "timings": {},
+        }
+        for item in questions
+    ]
+    finished = set()
+
+    def finish(position):
+        result = results[position]
+        result["timings"]["total"] = sum(result["timings"].values())
+        finished.add(position)
+        if on_result:
+            on_result(result)
+
+    folders = []
+    try:
+        # Parse every question up front
+        with ThreadPoolExecutor(max_workers=parse_workers) as pool:
+            parsed = list(pool.map(parse_question, [item["question"] for item in questions]))
+
+        units = {}
+        question_units = []
+        for position, (params, tokens, elapsed) in enumerate(parsed):
+            result = results[position]
+            result["timings"]["parse"] = elapsed
+            result["tokens"] = tokens
+            if "Error" in params:
+                result["error"] = f"Error processing query: {params['Error']}"
+                finish(position)
+                continue
+            result["category"] = params.get("category", "text").lower()
+            keys = filing_units(params)
+            for key in keys:
+                # Forms are merged per unit, so a unit's index may include forms
+                # requested by another question sharing it
+                unit = units.setdefault(key, {"forms": set(), "questions": 0})
+                unit["forms"].update(params.get("relevant_forms") or [])
+                unit["questions"] += 1
+            question_units.append((position, keys))
+
+        # Fetch and index each unit once
+        with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+            futures = {
+                key: pool.submit(fetch_and_index, key, unit["forms"])
+                for key, unit in units.items()
+            }
+        for key, future in futures.items():
+            folder_name, index, fetch_time, index_time = future.result()
+            if folder_name:
+                folders.append(folder_name)
+            units[key].update(index=index, fetch=fetch_time, build=index_time)
+
+        # Answer with bounded parallelism over the union of each question's units
+        with ThreadPoolExecutor(max_workers=answer_workers) as pool:
+            answers = {}
+            for position, keys in question_units:
+                result = results[position]
+                result["filings"] = [f"{cik}:{timeframe}" for cik, timeframe in keys]
+                result["shared_filings"] = sum(1 for key in keys if units[key]["questions"] > 1)
+                result["timings"]["fetch"] = sum(units[key]["fetch"] for key in keys)
+                result["timings"]["index"] = sum(units[key]["build"] for key in keys)
+                indexes = [units[key]["index"] for key in keys if units[key]["index"] is not None]
+                if not indexes:
+                    result["error"] = "Failed to retrieve documents."
+                    finish(position)
+                    continue
+                future = pool.submit(answer_question, indexes, result["question"], result["category"])
+                answers[future] = position
+            for future in as_completed(answers):
+                position = answers[future]
+                response, decision, error, elapsed = future.result()
+                results[position]["response"] = response
+                results[position]["routing"] = decision
+                results[position]["error"] = error
+                results[position]["timings"]["answer"] = elapsed
+                finish(position)
+    finally:
+        for position in range(len(results)):
+            if position not in finished:
+                if not results[position]["error"]:
+                    results[position]["error"] = "Batch stopped before this question was answered."
+                finish(position)
+        for folder_name in folders:
+            if os.path.exists(folder_name):
+                shutil.rmtree(folder_name)
+                print(f"Deleted folder: {folder_name}")
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of financial questions in one batch."
+    )
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="JSONL file to write results to")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS)
+    parser.add_argument("--answer-workers", type=int, default=ANSWER_WORKERS)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    questions = read_questions(args.input)
+
+    # Results are written as they finish, so a crash or Ctrl-C keeps what's done
+    with open(args.output, "w") as f:
+
+        def write_result(result):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+
+        results = run_batch(
+            questions,
+            parse_workers=args.parse_workers,
+            fetch_workers=args.fetch_workers,
+            answer_workers=args.answer_workers,
+            on_result=write_result,
+        )
+
+    failed = sum(1 for result in results if result["error"])
+    print(
+        f"Answered {len(results) - failed}/{len(results)} questions "
+        f"in {time.time() - start:.1f}s, wrote {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
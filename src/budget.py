@@ -0,0 +1,127 @@
+import re
+import json
+import hashlib
+import tiktoken
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+SMALL_MODEL = "gpt-4o-mini"
+LARGE_MODEL = "gpt-4o"
+
+SIMILARITY_TOP_K = 4
+# What index.as_query_engine() sent by default, used as the baseline for tokens saved
+BASELINE_TOP_K = 2
+# About two default 1024-token chunks plus their metadata
+CONTEXT_TOKEN_BUDGET = 2400
+HISTORY_TOKEN_BUDGET = 600
+HISTORY_MESSAGE_TOKENS = 250
+# Budgeted context plus history above which text questions go to the large
+# model: about one default chunk with a little history fits, while several
+# large chunks, long history or multi-index batch contexts don't
+SMALL_MODEL_MAX_TOKENS = 1500
+LARGE_MODEL_CATEGORIES = {"arithmetic", "visualization"}
+LEXICAL_WEIGHT = 0.2
+
+# llama_index ships the cl100k_base file; loading it through get_tokenizer
+# first means tiktoken never has to download it
+get_tokenizer()
+_encoding = tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    return len(_encoding.encode(text))
+
+
+def _truncate(text, max_tokens):
+    tokens = _encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding.decode(tokens[:max_tokens]) + "..."
+
+
+def _terms(text):
+    return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 3}
+
+
+def budget_nodes(nodes, query, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Dedups retrieved chunks, reranks them by similarity plus query term
+    overlap, and keeps the best ones that fit in the token budget. The top
+    chunk is always kept. Tokens are counted as the synthesizer sends them,
+    metadata included.
+
+    Returns the kept nodes, the tokens the top BASELINE_TOP_K chunks by
+    similarity would have used, and the tokens of the kept chunks.
+    """
+    query_terms = _terms(query)
+    seen = set()
+    candidates = []
+    scored = []
+    for node in nodes:
+        text = node.node.get_content()
+        tokens = count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+        scored.append((node.score or 0, tokens))
+        digest = hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        overlap = len(query_terms & _terms(text)) / len(query_terms) if query_terms else 0
+        candidates.append(((node.score or 0) + LEXICAL_WEIGHT * overlap, tokens, node))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    baseline_tokens = sum(tokens for _, tokens in scored[:BASELINE_TOP_K])
+
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    kept = []
+    kept_tokens = 0
+    for _, tokens, node in candidates:
+        if kept and kept_tokens + tokens > budget:
+            continue
+        kept.append(node)
+        kept_tokens += tokens
+    return kept, baseline_tokens, kept_tokens
+
+
+def _format_history(messages):
+    context = ""
+    for query, response in messages:
+        context += f"Query: {query} \nResponse: {response}\n==========================\n"
+    return context
+
+
+def _compress_response(response):
+    # Visualization answers are stored as chart JSON; only the chart itself is useful context
+    try:
+        chart = json.loads(response)
+    except (TypeError, json.JSONDecodeError):
+        chart = None
+    if isinstance(chart, dict) and "chart_type" in chart:
+        return f"[{chart.get('chart_type')} chart: {chart.get('title', '')}]"
+    return _truncate(response, HISTORY_MESSAGE_TOKENS)
+
+
+def compress_history(messages, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Formats (query, response) pairs as follow-up context, newest messages
+    first in priority, within the token budget.
+
+    Returns the context text, the tokens of the uncompressed history, and the
+    tokens of the compressed history.
+    """
+    raw_tokens = count_tokens(_format_history(messages)) if messages else 0
+    kept = []
+    kept_tokens = 0
+    for query, response in reversed(messages):
+        entry = (query, _compress_response(response))
+        tokens = count_tokens(_format_history([entry]))
+        if kept_tokens + tokens > budget:
+            break
+        kept.append(entry)
+        kept_tokens += tokens
+    return _format_history(kept[::-1]), raw_tokens, kept_tokens
+
+
+def route_model(category, context_tokens):
+    if category in LARGE_MODEL_CATEGORIES or context_tokens > SMALL_MODEL_MAX_TOKENS:
+        return LARGE_MODEL
+    return SMALL_MODEL
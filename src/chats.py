@@ -0,0 +1,135 @@
+import csv
+import io
+import asyncio
+from prisma import Prisma
+
+PAGE_SIZE = 20
+EXPORT_BATCH_SIZE = 500
+CSV_HEADER = ["chat_id", "query", "response"]
+
+async def _create_chat():
+    db = Prisma()
+    await db.connect()
+    chat = await db.chat.create(data={})
+    await db.disconnect()
+    return chat.id
+
+async def _list_chats():
+    db = Prisma()
+    await db.connect()
+    chats = await db.chat.find_many(order={"id": "asc"})
+    await db.disconnect()
+    return [chat.id for chat in chats]
+
+async def _add_message(chat_id, query, response):
+    db = Prisma()
+    await db.connect()
+    message = await db.message.create(
+        {
+            "chatId": chat_id,
+            "query": query,
+            "response": response,
+        }
+    )
+    await db.disconnect()
+    return message.id
+
+async def _count_messages(chat_ids):
+    db = Prisma()
+    await db.connect()
+    rows = await db.message.group_by(
+        by=["chatId"],
+        where={"chatId": {"in": chat_ids}},
+        count=True,
+    )
+    await db.disconnect()
+    return {row["chatId"]: row["_count"]["_all"] for row in rows}
+
+async def _get_messages(chat_id, skip, take, newest_first):
+    db = Prisma()
+    await db.connect()
+    messages = await db.message.find_many(
+        where={"chatId": chat_id},
+        order={"id": "desc" if newest_first else "asc"},
+        skip=skip,
+        take=take,
+    )
+    await db.disconnect()
+    return [(message.query, message.response) for message in messages]
+
+async def _export_chats(counts, batch_size):
+    db = Prisma()
+    await db.connect()
+    exports = {}
+    for chat_id, count in counts.items():
+        rows = []
+        after_id = 0
+        # Keyset pagination on (chatId, id), stopping at the counted messages so
+        # the export matches the version it is cached under
+        while len(rows) < count:
+            messages = await db.message.find_many(
+                where={"chatId": chat_id, "id": {"gt": after_id}},
+                order=[{"chatId": "asc"}, {"id": "asc"}],
+                take=min(batch_size, count - len(rows)),
+            )
+            if not messages:
+                break
+            rows += [(chat_id, message.query, message.response) for message in messages]
+            after_id = messages[-1].id
+        exports[chat_id] = _to_csv(rows)
+    await db.disconnect()
+    return exports
+
+def create_chat():
+    return asyncio.run(_create_chat())
+
+def list_chats():
+    return asyncio.run(_list_chats())
+
+def add_message(chat_id, query, response):
+    """
+    Appends a query/response pair to a chat. Messages are never updated or
+    deleted, so a chat's message count doubles as the version of its cached
+    pages and exports.
+    """
+    return asyncio.run(_add_message(chat_id, query, response))
+
+def count_messages(chat_ids):
+    """
+    Returns the message count of each chat in chat_ids, using one connection.
+    """
+    counts = asyncio.run(_count_messages(list(chat_ids)))
+    return {chat_id: counts.get(chat_id, 0) for chat_id in chat_ids}
+
+def get_page(chat_id, page, message_count, page_size=PAGE_SIZE):
+    """
+    Returns one page (0-indexed) of (query, response) pairs, oldest first,
+    limited to the first message_count messages.
+    """
+    take = min(page_size, message_count - page * page_size)
+    if take <= 0:
+        return []
+    return asyncio.run(_get_messages(chat_id, page * page_size, take, False))
+
+def get_recent(chat_id, count):
+    """
+    Returns the last `count` (query, response) pairs, oldest first.
+    """
+    return asyncio.run(_get_messages(chat_id, 0, count, True))[::-1]
+
+def _to_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+def csv_header():
+    return _to_csv([CSV_HEADER])
+
+def export_chats(counts, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Builds the CSV rows (without header) of the first count messages of each
+    chat in counts, a {chat_id: count} dict, over a single connection.
+    """
+    if not counts:
+        return {}
+    return asyncio.run(_export_chats(counts, batch_size))
@@ -1,7 +1,7 @@
 import requests
 import os
 import uuid
-import time
+import shutil
 import json
 import streamlit as st
 from openai import OpenAI
@@ -9,6 +9,7 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import pdfkit
 from src.download_xbrl_data import download_documents
+from src.edgar_cache import get_json, wait_for_rate_limit, SUBMISSIONS_TTL, FRAMES_TTL
 
 os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
 client = OpenAI()
@@ -102,7 +103,11 @@ def get_relevant_form_types(user_query: str):
 
 def get_params(user_query):
     try:
-        response, ask_tokens = ask_llm(user_query)
+        result = ask_llm(user_query)
+        # ask_llm returns a bare error string on failure
+        if isinstance(result, str):
+            return {"Error": result}, 0
+        response, ask_tokens = result
         parsed_result = response.split(":")
 
         ciks_str = parsed_result[0].strip()
@@ -112,7 +117,10 @@ def get_params(user_query):
         ciks = [c.strip() for c in ciks_str.split(",")]
         timeframes = [t.strip() for t in timeframes_str.split(",")]
 
-        relevant_forms, forms_tokens = get_relevant_form_types(user_query)
+        result = get_relevant_form_types(user_query)
+        if isinstance(result, str):
+            return {"Error": result}, 0
+        relevant_forms, forms_tokens = result
 
         total_tokens = ask_tokens + forms_tokens
 
@@ -123,7 +131,7 @@ def get_params(user_query):
             "relevant_forms": relevant_forms,
         }, total_tokens
     except Exception as e:
-        return {"Error": str(e)}
+        return {"Error": str(e)}, 0
 
 
 def get_documents(params):
@@ -144,6 +152,7 @@ def get_documents(params):
             )
         except Exception as e:
             print(f"Error in getting documents: {e}")
+            shutil.rmtree(folder_name, ignore_errors=True)
             return None
 
     return folder_name
@@ -151,7 +160,6 @@ def get_documents(params):
 
 def get_documents_submissions(ciks, folder_name, start_date, relevant_forms):
     base_url = "https://data.sec.gov/submissions/CIK"
-    file_path = os.path.join(folder_name, "edgar_data.json")
 
     for cik in ciks:
         cik_padded = cik.zfill(10)
@@ -164,13 +172,7 @@ def get_documents_submissions(ciks, folder_name, start_date, relevant_forms):
         }
 
         try:
-            time.sleep(0.1)
-            response = requests.get(api_url, headers=headers)
-            response.raise_for_status()
-
-            data = response.json()
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=4)
+            data = get_json(api_url, headers, SUBMISSIONS_TTL)
 
             # Earliest filing date from the fetched data
             if (
@@ -190,10 +192,7 @@ def get_documents_submissions(ciks, folder_name, start_date, relevant_forms):
                         st.warning('SEC filings cannot be found, so answers have a greater likelihood to be inaccurate or vague.', icon="⚠️")
                         get_documents_frames(ciks, folder_name, start_date)
                     else:
-                        download_edgar_files(folder_name, start_date, relevant_forms)
-
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
+                        download_edgar_files(data, folder_name, start_date, relevant_forms)
 
         except requests.exceptions.RequestException as e:
             print(f"Request failed for CIK {cik}: {e}")
@@ -225,11 +224,8 @@ def get_documents_frames(ciks, folder_name, start_date):
             for concept in concepts:
                 api_url = f"{base_url}/default/{concept}/USD/CY{start_date.year}Q{start_date.quarter}I.json"
 
-                time.sleep(0.1)
-                response = requests.get(api_url, headers=headers)
-                response.raise_for_status()
-
-                data = response.json()
+                # Frames cover every filer, so they're kept on disk only; filter into a copy
+                data = dict(get_json(api_url, headers, FRAMES_TTL, keep_in_memory=False))
 
                 if "data" in data:
                     cik = int(str(cik).lstrip("0"))
@@ -255,10 +251,7 @@ def get_documents_frames(ciks, folder_name, start_date):
     return folder_name
 
 
-def download_edgar_files(folder_name, start_date, relevant_forms):
-    with open(os.path.join(folder_name, "edgar_data.json"), "r") as f:
-        data = json.load(f)
-
+def download_edgar_files(data, folder_name, start_date, relevant_forms):
     recent_filings = data["filings"]["recent"]
     cik = data["cik"]
     primaryDocumentLink = recent_filings["primaryDocument"]
@@ -284,10 +277,10 @@ def download_edgar_files(folder_name, start_date, relevant_forms):
                     accession_number = "".join(accession_number.split("-"))
                     html_url = f"https://www.sec.gov/Archives/edgar/data/{cik}/{accession_number}/{primaryDocument}"
                     output_path = os.path.join(folder_name, f"{accession_number}.pdf")
+                    wait_for_rate_limit()
                     pdfkit.from_url(html_url, output_path)
                 except Exception as e:
                     print(f"Error: {e}")
-                time.sleep(0.1)
             elif filing_date < start_date:
                 break
 
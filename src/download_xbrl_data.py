@@ -1,5 +1,6 @@
 import os
 import requests
+from src.edgar_cache import wait_for_rate_limit
 
 def download_documents(xbrl_data, download_dir):
     """
@@ -22,6 +23,7 @@ def download_documents(xbrl_data, download_dir):
         for document in xbrl_data['documents']:
             url = document['url']
             filename = document['filename']
+            wait_for_rate_limit()
             response = requests.get(url, headers=headers)
             response.raise_for_status()
 
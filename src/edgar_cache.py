@@ -0,0 +1,208 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import requests
+
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".edgar_cache"
+)
+SUBMISSIONS_TTL = 6 * 60 * 60
+FRAMES_TTL = 24 * 60 * 60
+# Parsed JSON takes several times its body size in memory, so the LRU is
+# capped on body bytes; frames cover every filer and are kept on disk only
+MEMORY_MAX_BYTES = 32 * 1024 * 1024
+CORRUPT_BODY_ERRORS = (OSError, EOFError, gzip.BadGzipFile, json.JSONDecodeError)
+# SEC asks clients to stay under 10 requests per second
+MIN_REQUEST_INTERVAL = 0.1
+
+# url -> (fetched_at, parsed json, body size, stored_at of the body on disk)
+_memory = OrderedDict()
+_memory_bytes = 0
+_lock = threading.Lock()
+# url -> lock held while revalidating or downloading that url
+_url_locks = {}
+_rate_lock = threading.Lock()
+_last_request = 0.0
+
+
+def wait_for_rate_limit():
+    """
+    Spaces out requests to SEC hosts across every thread in this process.
+    Call it before each request to data.sec.gov or www.sec.gov.
+    """
+    global _last_request
+    with _rate_lock:
+        delay = _last_request + MIN_REQUEST_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        _last_request = time.monotonic()
+
+
+def _paths(url):
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return (
+        os.path.join(CACHE_DIR, f"{name}.json.gz"),
+        os.path.join(CACHE_DIR, f"{name}.meta.json"),
+    )
+
+
+def _remember(url, fetched_at, data, size, stored_at):
+    global _memory_bytes
+    if size > MEMORY_MAX_BYTES:
+        return
+    with _lock:
+        if url in _memory:
+            _memory_bytes -= _memory.pop(url)[2]
+        _memory[url] = (fetched_at, data, size, stored_at)
+        _memory_bytes += size
+        while _memory_bytes > MEMORY_MAX_BYTES:
+            _memory_bytes -= _memory.popitem(last=False)[1][2]
+
+
+def clear_memory():
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+
+
+def _url_lock(url):
+    with _lock:
+        return _url_locks.setdefault(url, threading.Lock())
+
+
+def _load_meta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _save_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _load_body(body_path):
+    with open(body_path, "rb") as f:
+        raw = gzip.decompress(f.read())
+    return json.loads(raw), len(raw)
+
+
+def _cached_body(url, meta, body_path):
+    # The cache directory is shared between processes, so the memory copy is
+    # only reused if it is the body the meta on disk describes
+    with _lock:
+        cached = _memory.get(url)
+    if cached and cached[3] is not None and cached[3] == meta.get("stored_at"):
+        return cached[1], cached[2]
+    return _load_body(body_path)
+
+
+def _read_fresh(url, ttl, keep_in_memory):
+    """
+    Returns (True, data) if a copy fetched within ttl seconds is cached in
+    memory or on disk, otherwise (False, meta) with the on-disk meta, if any.
+    """
+    now = time.time()
+    with _lock:
+        cached = _memory.get(url)
+    if cached and now - cached[0] < ttl:
+        return True, cached[1]
+
+    body_path, meta_path = _paths(url)
+    meta = _load_meta(meta_path) if os.path.exists(body_path) else None
+
+    if meta and now - meta["fetched_at"] < ttl:
+        try:
+            data, size = _cached_body(url, meta, body_path)
+        except CORRUPT_BODY_ERRORS:
+            return False, None
+        if keep_in_memory:
+            _remember(url, meta["fetched_at"], data, size, meta.get("stored_at"))
+        return True, data
+    return False, meta
+
+
+def get_json(url, headers, ttl, keep_in_memory=True):
+    """
+    Returns the parsed JSON at url, going to the network only when needed.
+
+    Responses are kept on disk as the raw gzipped body alongside their ETag and
+    Last-Modified headers. Within ttl seconds of the last fetch the cached copy
+    is used as is; after that the request is revalidated with If-None-Match /
+    If-Modified-Since and a 304 simply refreshes the timestamp. A cached body
+    that can't be read falls back to a full download. Unless keep_in_memory is
+    False, parsed results are also kept in a size-capped LRU so repeated
+    lookups skip decompression. Concurrent callers for the same url share a
+    single request.
+
+    Callers must treat the returned data as read-only since it is shared.
+    """
+    fresh, result = _read_fresh(url, ttl, keep_in_memory)
+    if fresh:
+        return result
+
+    with _url_lock(url):
+        # Another thread may have fetched it while this one waited
+        fresh, meta = _read_fresh(url, ttl, keep_in_memory)
+        if fresh:
+            return meta
+        return _fetch(url, headers, meta, keep_in_memory)
+
+
+def _fetch(url, headers, meta, keep_in_memory):
+    body_path, meta_path = _paths(url)
+    request_headers = dict(headers)
+    if meta:
+        if meta.get("etag"):
+            request_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            request_headers["If-Modified-Since"] = meta["last_modified"]
+
+    wait_for_rate_limit()
+    response = requests.get(url, headers=request_headers)
+
+    if response.status_code == 304 and meta:
+        try:
+            data, size = _cached_body(url, meta, body_path)
+        except CORRUPT_BODY_ERRORS:
+            # Revalidated but unreadable, so download it again unconditionally
+            wait_for_rate_limit()
+            response = requests.get(url, headers=headers)
+        else:
+            meta["fetched_at"] = time.time()
+            _save_meta(meta_path, meta)
+            if keep_in_memory:
+                _remember(url, meta["fetched_at"], data, size, meta.get("stored_at"))
+            return data
+
+    response.raise_for_status()
+    raw = response.content
+    data = json.loads(raw)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{body_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(gzip.compress(raw))
+    os.replace(tmp_path, body_path)
+    now = time.time()
+    meta = {
+        "url": url,
+        "fetched_at": now,
+        # Identifies this body, so other processes know their memory copy is stale
+        "stored_at": now,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    _save_meta(meta_path, meta)
+    if keep_in_memory:
+        _remember(url, now, data, len(raw), now)
+    return data
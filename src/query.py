@@ -7,7 +7,16 @@ from llama_index.core import (
     VectorStoreIndex,
     SimpleDirectoryReader,
     StorageContext,
-    load_index_from_storage
+    load_index_from_storage,
+    get_response_synthesizer
+)
+from llama_index.llms.openai import OpenAI
+from src.budget import (
+    SIMILARITY_TOP_K,
+    SMALL_MODEL,
+    budget_nodes,
+    compress_history,
+    route_model,
 )
 
 classification_prompt = """
@@ -47,6 +56,68 @@ User Query: {query}
 
 persist_dir = {}
 
+def build_index(folder):
+    # analyzes the documents in the folder provided
+    documents = SimpleDirectoryReader(folder).load_data()
+    return VectorStoreIndex.from_documents(documents)
+
+def parse_visualization(response):
+    response = response[response.find("{"):]
+    response = response[::-1]
+    response = response[response.find("}"):]
+    response = response[::-1]
+    return json.loads(response)
+
+def query_index(index, query, class_type, history=None):
+    """
+    Answers a query against an index, or the union of a list of indexes,
+    keeping the prompt within the context budget and routing it to a model
+    based on its category and size.
+
+    Returns the response and a dict recording the routing decision.
+    """
+    indexes = index if isinstance(index, list) else [index]
+    # Retrieve with the bare query so instructions don't skew similarity
+    retrieved = []
+    for ind in indexes:
+        retrieved += ind.as_retriever(similarity_top_k=SIMILARITY_TOP_K).retrieve(query)
+    nodes, baseline_context_tokens, context_tokens = budget_nodes(retrieved, query)
+
+    # Only text prompts carry chat history, so only they count it
+    raw_history_tokens = history_tokens = 0
+    if class_type == "text" or class_type == "arithmetic":
+        prompt = (
+            f"{query}\nPlease provide a definitive answer that directly answers the question using your general knowledge of the topic alongside the provided documents."
+            f"Be as precise as possible in your language. Do not be vague."
+            f"Make sure to support your answer with data points from the provided documents."
+            f"The current date is {datetime.today().strftime('%Y-%m-%d')}"
+        )
+        if history:
+            context, raw_history_tokens, history_tokens = compress_history(history)
+            prompt += f"\nHere are the most recent queries and responses for context:\n{context}"
+    elif class_type == "visualization":
+        prompt = visualization_prompt.format(query=query)
+    else:
+        raise ValueError(f"Invalid class: {class_type}")
+
+    model = route_model(class_type, context_tokens + history_tokens)
+
+    synthesizer = get_response_synthesizer(llm=OpenAI(model=model))
+    response = synthesizer.synthesize(prompt, nodes=nodes).response
+    if class_type == "visualization":
+        response = parse_visualization(response)
+
+    decision = {
+        "model": model,
+        "category": class_type,
+        "chunks_retrieved": len(retrieved),
+        "chunks_kept": len(nodes),
+        "context_tokens": context_tokens + history_tokens,
+        # Relative to the old default query engine; negative if more context was sent
+        "tokens_saved": (baseline_context_tokens - context_tokens) + (raw_history_tokens - history_tokens),
+    }
+    return response, decision
+
 def get_response(folder, query, class_type, ind):
     if f"{ind}" in persist_dir:
         shutil.rmtree(f"{persist_dir[f'{ind}']}")
@@ -58,68 +129,34 @@ def get_response(folder, query, class_type, ind):
 
     # Ingesting documents
     with st.spinner("Ingesting documents..."):
-        documents = SimpleDirectoryReader(folder).load_data()
-        # analyzes the documents in the folder provided
-        index = VectorStoreIndex.from_documents(documents)
+        index = build_index(folder)
         if ind is not None:
             index.storage_context.persist(persist_dir=dir)
     
     with st.spinner("Generating response..."):
-        query_engine = index.as_query_engine()
-        # gets the response
-        if class_type == "text" or class_type == "arithmetic":
-            prompt = (
-                f"{query}\nPlease provide a definitive answer that directly answers the question using your general knowledge of the topic alongside the provided documents."
-                f"Be as precise as possible in your language. Do not be vague."
-                f"Make sure to support your answer with data points from the provided documents."
-                f"The current date is {datetime.today().strftime('%Y-%m-%d')}"
-            )
-            response = query_engine.query(prompt)
-            response = response.response
-        elif class_type == "visualization":
-            visualization_query = visualization_prompt.format(query=query)
-            response = query_engine.query(visualization_query)
-            response = response.response
-            response = response[response.find("{"):]
-            response = response[::-1]
-            response = response[response.find("}"):]
-            response = response[::-1]
-            response = json.loads(response)
-        else:
-            raise ValueError(f"Invalid class: {class_type}")
-
-    return response, 0
+        response, decision = query_index(index, query, class_type)
+
+    return response, 0, decision
   
-def get_follow_up(query, ind, context):
+def classify(query):
+    # Classification only needs the question itself, not retrieved documents
+    classification_query = classification_prompt.format(query=query)
+    classification = OpenAI(model=SMALL_MODEL).complete(classification_query).text.strip().lower()
+    if classification not in ("text", "arithmetic", "visualization"):
+        return "text"
+    return classification
+
+def get_follow_up(query, ind, history):
     if f"{ind}" in persist_dir:
         storage_context = StorageContext.from_defaults(persist_dir=persist_dir[f"{ind}"])
         index = load_index_from_storage(storage_context)
-        query_engine = index.as_query_engine()
-
-        classification_query = classification_prompt.format(query=query)
-        classification = query_engine.query(classification_query).response.strip().lower()
-
-        if classification == "visualization":
-            visualization_query = visualization_prompt.format(query=query)
-            response = query_engine.query(visualization_query)
-            response = response.response
-            response = response[response.find("{"):]
-            response = response[::-1]
-            response = response[response.find("}"):]
-            response = response[::-1]
-            response = json.loads(response)
-        else:
-            prompt = (
-                f"{query}\nPlease provide a definitive answer that directly answers the question using your general knowledge of the topic alongside the provided documents."
-                f"Be as precise as possible in your language. Do not be vague."
-                f"Make sure to support your answer with data points from the documents provided.\n"
-                f"Here are the last 3 queries and responses for context:\n{context}"
-            )
-            response = query_engine.query(prompt).response
-
-        return response, 0, classification
+
+        classification = classify(query)
+        response, decision = query_index(index, query, classification, history)
+
+        return response, 0, classification, decision
     else:
-        return "Please make a query before asking a follow-up question.", 0
+        return "Please make a query before asking a follow-up question.", 0, "text", None
 
 def clear_persist():
     clicked = st.button("Clear memory of models")
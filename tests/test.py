@@ -0,0 +1,418 @@
+import os
+import sys
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, call
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode  # noqa: E402
+from src import batch, budget, edgar_cache  # noqa: E402
+
+URL = "https://data.sec.gov/submissions/CIK0000320193.json"
+HEADERS = {"User-Agent": "test@example.com"}
+DATA = {"cik": "320193", "filings": {"recent": {"form": ["10-Q"]}}}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode("utf-8") if data is not None else b""
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise edgar_cache.requests.exceptions.HTTPError(self.status_code)
+
+
+class TestEdgarCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        patches = [
+            patch.object(edgar_cache, "CACHE_DIR", self.cache_dir),
+            patch.object(edgar_cache.time, "sleep"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        edgar_cache.clear_memory()
+        self.addCleanup(edgar_cache.clear_memory)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def fetch(self, responses, ttl=60, **kwargs):
+        with patch.object(edgar_cache.requests, "get", side_effect=responses) as get:
+            data = edgar_cache.get_json(URL, HEADERS, ttl, **kwargs)
+        return data, get
+
+    def corrupt_body(self):
+        body_path, _ = edgar_cache._paths(URL)
+        with open(body_path, "wb") as f:
+            f.write(b"not gzip")
+
+    def test_stores_compressed_body_and_validators(self):
+        data, get = self.fetch(
+            [FakeResponse(data=DATA, headers={"ETag": '"abc"', "Last-Modified": "Mon"})]
+        )
+        self.assertEqual(data, DATA)
+        self.assertEqual(get.call_count, 1)
+
+        body_path, meta_path = edgar_cache._paths(URL)
+        with open(body_path, "rb") as f:
+            self.assertEqual(json.loads(gzip.decompress(f.read())), DATA)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.assertEqual(meta["etag"], '"abc"')
+        self.assertEqual(meta["last_modified"], "Mon")
+
+    def test_memory_hit_skips_network(self):
+        self.fetch([FakeResponse(data=DATA)])
+        data, get = self.fetch([])
+        self.assertEqual(data, DATA)
+        get.assert_not_called()
+
+    def test_disk_hit_within_ttl_skips_network(self):
+        self.fetch([FakeResponse(data=DATA)])
+        edgar_cache.clear_memory()
+        data, get = self.fetch([])
+        self.assertEqual(data, DATA)
+        get.assert_not_called()
+
+    def test_expired_entry_revalidates_with_304(self):
+        self.fetch([FakeResponse(data=DATA, headers={"ETag": '"abc"', "Last-Modified": "Mon"})])
+        _, meta_path = edgar_cache._paths(URL)
+        with open(meta_path) as f:
+            fetched_at = json.load(f)["fetched_at"]
+
+        data, get = self.fetch([FakeResponse(status_code=304)], ttl=0)
+        self.assertEqual(data, DATA)
+        sent = get.call_args.kwargs["headers"]
+        self.assertEqual(sent["If-None-Match"], '"abc"')
+        self.assertEqual(sent["If-Modified-Since"], "Mon")
+        with open(meta_path) as f:
+            self.assertGreaterEqual(json.load(f)["fetched_at"], fetched_at)
+
+    def test_expired_entry_replaced_on_200(self):
+        self.fetch([FakeResponse(data=DATA, headers={"ETag": '"abc"'})])
+        new_data = {"cik": "320193", "filings": {}}
+        data, _ = self.fetch([FakeResponse(data=new_data, headers={"ETag": '"def"'})], ttl=0)
+        self.assertEqual(data, new_data)
+        edgar_cache.clear_memory()
+        data, get = self.fetch([])
+        self.assertEqual(data, new_data)
+        get.assert_not_called()
+
+    def test_corrupt_body_within_ttl_refetches(self):
+        self.fetch([FakeResponse(data=DATA, headers={"ETag": '"abc"'})])
+        edgar_cache.clear_memory()
+        self.corrupt_body()
+        data, get = self.fetch([FakeResponse(data=DATA)])
+        self.assertEqual(data, DATA)
+        self.assertNotIn("If-None-Match", get.call_args.kwargs["headers"])
+
+    def test_corrupt_body_after_304_refetches(self):
+        self.fetch([FakeResponse(data=DATA, headers={"ETag": '"abc"'})])
+        edgar_cache.clear_memory()
+        self.corrupt_body()
+        # A TTL of 0 skips the disk read, so the corrupt body is only seen after the 304
+        data, get = self.fetch([FakeResponse(status_code=304), FakeResponse(data=DATA)], ttl=0)
+        self.assertEqual(data, DATA)
+        self.assertEqual(get.call_count, 2)
+        self.assertNotIn("If-None-Match", get.call_args.kwargs["headers"])
+
+    def test_keep_in_memory_false_skips_lru(self):
+        self.fetch([FakeResponse(data=DATA)], keep_in_memory=False)
+        self.assertNotIn(URL, edgar_cache._memory)
+
+    def test_memory_is_capped_by_size(self):
+        with patch.object(edgar_cache, "MEMORY_MAX_BYTES", 10):
+            edgar_cache._remember("a", 0, {}, 6, 0)
+            edgar_cache._remember("b", 0, {}, 6, 0)
+            edgar_cache._remember("c", 0, {}, 11, 0)
+        self.assertEqual(list(edgar_cache._memory), ["b"])
+        self.assertEqual(edgar_cache._memory_bytes, 6)
+
+    def replace_body_elsewhere(self, new_data):
+        """
+        Simulates another process replacing the cached body, leaving this
+        process with an older in-memory copy.
+        """
+        self.fetch([FakeResponse(data=DATA, headers={"ETag": '"abc"'})])
+        _, old_data, size, stored_at = edgar_cache._memory[URL]
+        edgar_cache.clear_memory()
+        self.fetch([FakeResponse(data=new_data, headers={"ETag": '"def"'})], ttl=0)
+        edgar_cache._memory[URL] = (0, old_data, size, stored_at - 1)
+
+    def test_stale_memory_copy_not_reused_for_fresh_disk_body(self):
+        new_data = {"cik": "320193", "filings": {}}
+        self.replace_body_elsewhere(new_data)
+        data, get = self.fetch([])
+        self.assertEqual(data, new_data)
+        get.assert_not_called()
+
+    def test_stale_memory_copy_not_reused_after_304(self):
+        new_data = {"cik": "320193", "filings": {}}
+        self.replace_body_elsewhere(new_data)
+        data, get = self.fetch([FakeResponse(status_code=304)], ttl=0)
+        self.assertEqual(data, new_data)
+        self.assertEqual(get.call_args.kwargs["headers"]["If-None-Match"], '"def"')
+
+    def test_concurrent_misses_share_one_request(self):
+        release = threading.Event()
+
+        def slow_get(url, headers):
+            release.wait(1)
+            return FakeResponse(data=DATA)
+
+        results = []
+        with patch.object(edgar_cache.requests, "get", side_effect=slow_get) as get:
+            threads = [
+                threading.Thread(target=lambda: results.append(edgar_cache.get_json(URL, HEADERS, 60)))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            threading.Event().wait(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(results, [DATA] * 3)
+
+    def test_rate_limit_spaces_requests(self):
+        with patch.object(edgar_cache, "_last_request", 0.0), patch.object(
+            edgar_cache.time, "monotonic", side_effect=[100.0, 100.0, 100.02, 100.1]
+        ):
+            edgar_cache.wait_for_rate_limit()
+            edgar_cache.wait_for_rate_limit()
+        edgar_cache.time.sleep.assert_called_once()
+        self.assertAlmostEqual(edgar_cache.time.sleep.call_args.args[0], 0.08)
+
+
+def fake_params(ciks, timeframes="2024Q1", category="Text", forms="8-K"):
+    return {
+        "ciks": ciks.split(","),
+        "timeframes": timeframes.split(","),
+        "category": category,
+        "relevant_forms": forms.split(","),
+    }, 10
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write_questions(self, lines):
+        path = os.path.join(self.tmp_dir, "questions.jsonl")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def test_read_questions(self):
+        path = self.write_questions(
+            [
+                '"Plain string question"',
+                "",
+                '{"id": "q2", "question": "Object question"}',
+                '{"query": "Query field"}',
+            ]
+        )
+        self.assertEqual(
+            batch.read_questions(path),
+            [
+                {"id": 1, "question": "Plain string question"},
+                {"id": "q2", "question": "Object question"},
+                {"id": 4, "question": "Query field"},
+            ],
+        )
+
+    def test_read_questions_requires_question(self):
+        path = self.write_questions(['{"id": 1}'])
+        with self.assertRaises(ValueError):
+            batch.read_questions(path)
+
+    def test_filing_units(self):
+        params, _ = fake_params("320193,789019", "2024Q2,2024Q1")
+        self.assertEqual(
+            batch.filing_units(params),
+            [
+                ("0000320193", "2024Q1"),
+                ("0000320193", "2024Q2"),
+                ("0000789019", "2024Q1"),
+                ("0000789019", "2024Q2"),
+            ],
+        )
+
+    def run_stubbed(self, params, fetched, answers):
+        """
+        Runs a batch with get_params, fetch_and_index and query_index stubbed.
+        fetched maps a unit to its fake index (None for a failed fetch) and
+        answers maps a question to its response or an exception to raise.
+        """
+        questions = [{"id": i, "question": question} for i, question in enumerate(params)]
+
+        def get_params(question):
+            result = params[question]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        def fetch_and_index(unit, forms):
+            return None, fetched[unit], 1.0, 2.0
+
+        def query_index(indexes, question, category):
+            answer = answers[question]
+            if isinstance(answer, Exception):
+                raise answer
+            return answer, {"model": "m", "indexes": indexes}
+
+        written = []
+        with patch.object(batch, "get_params", side_effect=get_params), patch.object(
+            batch, "fetch_and_index", side_effect=fetch_and_index
+        ) as fetch, patch.object(batch, "query_index", side_effect=query_index) as query:
+            results = batch.run_batch(questions, on_result=written.append)
+        return results, written, fetch, query
+
+    def test_run_batch_shares_units(self):
+        apple, microsoft = ("0000320193", "2024Q1"), ("0000789019", "2024Q1")
+        results, written, fetch, query = self.run_stubbed(
+            {
+                "apple": fake_params("320193", forms="8-K"),
+                "both": fake_params("0000320193,789019", forms="DEF 14A"),
+            },
+            {apple: "apple-index", microsoft: "microsoft-index"},
+            {"apple": "A", "both": "B"},
+        )
+
+        self.assertEqual(fetch.call_count, 2)
+        self.assertCountEqual(
+            fetch.call_args_list,
+            [call(apple, {"8-K", "DEF 14A"}), call(microsoft, {"DEF 14A"})],
+        )
+        query.assert_any_call(["apple-index"], "apple", "text")
+        query.assert_any_call(["apple-index", "microsoft-index"], "both", "text")
+
+        self.assertEqual([result["response"] for result in results], ["A", "B"])
+        self.assertEqual([result["shared_filings"] for result in results], [1, 1])
+        self.assertEqual(results[1]["timings"]["fetch"], 2.0)
+        self.assertIsNone(results[0]["error"])
+        self.assertCountEqual(written, results)
+
+    def test_run_batch_reports_errors(self):
+        apple, tesla = ("0000320193", "2024Q1"), ("0001318605", "2024Q1")
+        results, written, _, query = self.run_stubbed(
+            {
+                "unparsed": ({"Error": "bad response"}, 0),
+                "raises": RuntimeError("boom"),
+                "missing": fake_params("1318605"),
+                "fails": fake_params("320193"),
+            },
+            {apple: "apple-index", tesla: None},
+            {"fails": RuntimeError("llm down")},
+        )
+
+        errors = [result["error"] for result in results]
+        self.assertEqual(errors[0], "Error processing query: bad response")
+        self.assertEqual(errors[1], "Error processing query: boom")
+        self.assertEqual(errors[2], "Failed to retrieve documents.")
+        self.assertEqual(errors[3], "Error processing query: llm down")
+        query.assert_called_once_with(["apple-index"], "fails", "text")
+        self.assertEqual(len(written), 4)
+
+    def test_run_batch_writes_unfinished_results_on_failure(self):
+        questions = [{"id": 1, "question": "q"}]
+        written = []
+        with patch.object(batch, "get_params", return_value=fake_params("320193")), patch.object(
+            batch, "fetch_and_index", side_effect=KeyboardInterrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                batch.run_batch(questions, on_result=written.append)
+        self.assertEqual(len(written), 1)
+        self.assertEqual(written[0]["error"], "Batch stopped before this question was answered.")
+
+
+def fake_node(text, score, **metadata):
+    return NodeWithScore(node=TextNode(text=text, metadata=metadata), score=score)
+
+
+def llm_tokens(node):
+    return budget.count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+
+
+class TestBudget(unittest.TestCase):
+    def test_dedups_and_counts_top_two_baseline(self):
+        first = fake_node("Apple revenue was $90B in Q1 2024.", 0.9)
+        duplicate = fake_node("apple revenue   was $90B in Q1 2024.", 0.8)
+        other = fake_node("Microsoft opened a new office.", 0.5)
+
+        kept, baseline_tokens, kept_tokens = budget.budget_nodes(
+            [first, duplicate, other], "What was Apple revenue?"
+        )
+
+        self.assertEqual(kept, [first, other])
+        self.assertEqual(baseline_tokens, llm_tokens(first) + llm_tokens(duplicate))
+        self.assertEqual(kept_tokens, llm_tokens(first) + llm_tokens(other))
+
+    def test_reranks_by_query_overlap(self):
+        unrelated = fake_node("Board meeting minutes and attendance.", 0.80)
+        relevant = fake_node("Apple quarterly revenue grew strongly.", 0.75)
+        kept, _, _ = budget.budget_nodes([unrelated, relevant], "Apple quarterly revenue")
+        self.assertEqual(kept, [relevant, unrelated])
+
+    def test_always_keeps_oversized_top_chunk(self):
+        big = fake_node("revenue " * 300, 0.9)
+        small = fake_node("Small note about revenue.", 0.5)
+        kept, _, kept_tokens = budget.budget_nodes([big, small], "revenue", budget=50)
+        self.assertEqual(kept, [big])
+        self.assertEqual(kept_tokens, llm_tokens(big))
+
+    def test_counts_metadata_tokens(self):
+        node = fake_node("Revenue rose.", 0.9, file_name="000032019324000006.pdf")
+        _, _, kept_tokens = budget.budget_nodes([node], "revenue")
+        self.assertGreater(kept_tokens, budget.count_tokens("Revenue rose."))
+        self.assertEqual(kept_tokens, llm_tokens(node))
+
+    def test_compress_history_collapses_charts_and_truncates(self):
+        chart = json.dumps(
+            {"chart_type": "bar", "title": "Apple revenue", "data": {"x": list(range(200)), "y": list(range(200))}}
+        )
+        long_answer = "word " * 1000
+        context, raw_tokens, kept_tokens = budget.compress_history(
+            [("Plot revenue", chart), ("Explain it", long_answer)]
+        )
+
+        self.assertIn("Response: [bar chart: Apple revenue]", context)
+        self.assertNotIn('"data"', context)
+        self.assertIn("...", context)
+        self.assertEqual(kept_tokens, budget.count_tokens(context))
+        self.assertGreater(raw_tokens, kept_tokens)
+
+    def test_compress_history_keeps_newest_within_budget(self):
+        messages = [("First question", "first answer " * 40), ("Latest question", "latest answer")]
+        context, _, kept_tokens = budget.compress_history(messages, budget=30)
+        self.assertNotIn("First question", context)
+        self.assertIn("Latest question", context)
+        self.assertLessEqual(kept_tokens, 30)
+
+    def test_route_model(self):
+        self.assertEqual(budget.route_model("text", 800), budget.SMALL_MODEL)
+        self.assertEqual(
+            budget.route_model("text", budget.SMALL_MODEL_MAX_TOKENS + 1), budget.LARGE_MODEL
+        )
+        self.assertEqual(budget.route_model("arithmetic", 100), budget.LARGE_MODEL)
+        self.assertEqual(budget.route_model("visualization", 100), budget.LARGE_MODEL)
+
+    def test_two_default_chunks_route_to_large_model(self):
+        chunks = [fake_node(f"filing section {i} " + "revenue " * 1000, 0.9 - i / 10) for i in range(2)]
+        _, _, kept_tokens = budget.budget_nodes(chunks, "revenue")
+        self.assertEqual(budget.route_model("text", kept_tokens), budget.LARGE_MODEL)
+        _, _, one_chunk_tokens = budget.budget_nodes(chunks[:1], "revenue")
+        self.assertEqual(budget.route_model("text", one_chunk_tokens), budget.SMALL_MODEL)
+
+
+if __name__ == "__main__":
+    unittest.main()